@@ -1,105 +1,182 @@
+import asyncio
 import datetime
+import functools
 import logging.config
 from environs import Env
 from seller import download_stock
 
-import requests
+import httpx
+import orjson
 
-from seller import divide, price_conversion
+from seller import (
+    create_async_client,
+    create_client,
+    divide,
+    gather_batches,
+    send_with_retry,
+    send_with_retry_async,
+    stocks_conversion,
+    use_async_client,
+)
 
 logger = logging.getLogger(__file__)
 
+MARKET_URL = "https://api.partner.market.yandex.ru/"
 
-def get_product_list(page, campaign_id, access_token):
+_CLIENT = create_client()
+
+
+@functools.lru_cache(maxsize=4)
+def _market_headers(access_token):
+    """Заголовки запросов к ЯндексМаркет, один словарь на каждый токен.
+
+    Заголовок Host не нужен, его подставляет httpx.
+    """
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {access_token}",
+        "Accept": "application/json",
+    }
+
+
+def get_product_list(page, campaign_id, access_token, client=None):
     """Отправим запрос на Яндекс и получим информацию о товарах в каталоге.
 
     Args:
         page(str): Идентификатор страницы c результатами
         campaign_id(str): Идентификатор магазина продавца
         access_token(str): API токен продавца
+        client(httpx.Client): HTTP-клиент, по умолчанию общий клиент модуля
 
     Results:
         dict: Словарь с информацией о товарах
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = _market_headers(access_token)
     payload = {
         "page_token": page,
         "limit": 200,
     }
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
+    url = MARKET_URL + f"campaigns/{campaign_id}/offer-mapping-entries"
+    if client is None:
+        client = _CLIENT
+    response = send_with_retry(client, "GET", url, headers=headers, params=payload)
     response.raise_for_status()
     response_object = response.json()
     return response_object.get("result")
 
 
-def update_stocks(stocks, campaign_id, access_token):
+def update_stocks(stocks, campaign_id, access_token, client=None):
     """Позволяет изменить количество товара в наличии на сайте ЯндексМаркет.
 
     Args:
         stocks(list): Список с остатками продукции
         campaign_id(str): Идентификатор магазина продавца
         access_token(str): API токен продавца
+        client(httpx.Client): HTTP-клиент, по умолчанию общий клиент модуля
 
     Returns:
         response_object(dict): Словарь со статусом подтверждения обновления
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = _market_headers(access_token)
     payload = {"skus": stocks}
-    url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
+    url = MARKET_URL + f"campaigns/{campaign_id}/offers/stocks"
+    if client is None:
+        client = _CLIENT
+    response = send_with_retry(
+        client, "PUT", url, headers=headers, content=orjson.dumps(payload)
+    )
     response.raise_for_status()
     response_object = response.json()
     return response_object
 
 
-def update_price(prices, campaign_id, access_token):
+def update_price(prices, campaign_id, access_token, client=None):
     """Позволяет изменить цену одного или нескольких товаров продавца на сайте ЯндексМаркет.
 
     Args:
         prices(list): Список с новыми ценами продукции продавца
         campaign_id(str): Идентификатор магазина продавца
         access_token(str): API токен продавца
+        client(httpx.Client): HTTP-клиент, по умолчанию общий клиент модуля
 
     Returns:
         response_object(dict): Словарь со статусом подтверждения обновления
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
+    headers = _market_headers(access_token)
     payload = {"offers": prices}
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
+    url = MARKET_URL + f"campaigns/{campaign_id}/offer-prices/updates"
+    if client is None:
+        client = _CLIENT
+    response = send_with_retry(
+        client, "POST", url, headers=headers, content=orjson.dumps(payload)
+    )
     response.raise_for_status()
     response_object = response.json()
     return response_object
 
 
+async def update_stocks_async(stocks, campaign_id, access_token, client):
+    """Асинхронно изменить количество товара в наличии на сайте ЯндексМаркет.
+
+    Args:
+        stocks(list): Список с остатками продукции
+        campaign_id(str): Идентификатор магазина продавца
+        access_token(str): API токен продавца
+        client(httpx.AsyncClient): HTTP-клиент, через который уходит запрос
+
+    Returns:
+        response_object(dict): Словарь со статусом подтверждения обновления
+
+    Raises:
+        httpx.HTTPStatusError: Ошибка отклика с сервера
+    """
+    headers = _market_headers(access_token)
+    payload = {"skus": stocks}
+    url = MARKET_URL + f"campaigns/{campaign_id}/offers/stocks"
+    response = await send_with_retry_async(
+        client, "PUT", url, headers=headers, content=orjson.dumps(payload)
+    )
+    response.raise_for_status()
+    response_object = response.json()
+    return response_object
+
+
+async def update_price_async(prices, campaign_id, access_token, client):
+    """Асинхронно изменить цену одного или нескольких товаров продавца на сайте ЯндексМаркет.
+
+    Args:
+        prices(list): Список с новыми ценами продукции продавца
+        campaign_id(str): Идентификатор магазина продавца
+        access_token(str): API токен продавца
+        client(httpx.AsyncClient): HTTP-клиент, через который уходит запрос
+
+    Returns:
+        response_object(dict): Словарь со статусом подтверждения обновления
+
+    Raises:
+        httpx.HTTPStatusError: Ошибка отклика с сервера
+    """
+    headers = _market_headers(access_token)
+    payload = {"offers": prices}
+    url = MARKET_URL + f"campaigns/{campaign_id}/offer-prices/updates"
+    response = await send_with_retry_async(
+        client, "POST", url, headers=headers, content=orjson.dumps(payload)
+    )
+    response.raise_for_status()
+    response_object = response.json()
+    return response_object
+
+
+@functools.lru_cache(maxsize=8)
 def get_offer_ids(campaign_id, market_token):
     """Получить из словаря артикулы товаров продавца.
 
@@ -108,32 +185,36 @@ def get_offer_ids(campaign_id, market_token):
         market_token(str): API токен продавца
 
     Results:
-        offer_ids(list): Список с артикулами товара продавца
+        offer_ids(tuple): Артикулы товара продавца, результат кэшируется
+            на время работы программы
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
+    # Страницы связаны через nextPageToken, поэтому запрашиваются
+    # последовательно через общий клиент
     page = ""
-    product_list = []
+    offer_ids = []
     while True:
         some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
+        offer_ids.extend(
+            product.get("offer").get("shopSku")
+            for product in some_prod.get("offerMappingEntries")
+        )
         page = some_prod.get("paging").get("nextPageToken")
         if not page:
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
-    return offer_ids
+    return tuple(offer_ids)
 
 
 def create_stocks(watch_remnants, offer_ids, warehouse_id):
     """Скорректируем остатки продукции учитывая реальное наличие у продавца.
 
     Args:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы,
-            остатки и цены с сайта часов
-        offer_ids(list): Список с артикулами товара продавца с ЯндексМаркет
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками
+            и ценами с сайта часов
+        offer_ids(tuple): Артикулы товара продавца с ЯндексМаркет в порядке
+            маркетплейса, функция их не изменяет
         warehouse_id(int): Идентификатор хранения товара на складе маркетплейса
             или на складе поставщика
 
@@ -142,46 +223,33 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
             реальные остатки продукции для обновления на маркетплейс ЯндексМаркет
     """
     # Уберем то, что не загружено в market
-    stocks = list()
     date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
-                {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
-                }
-            )
-            offer_ids.remove(str(watch.get("Код")))
+    # Поля, общие для всех записей об остатках
+    item_tail = {"type": "FIT", "updatedAt": date}
+    codes = watch_remnants["Код"]
+    # Повторяющийся артикул учитываем только один раз
+    selected = codes.isin(offer_ids) & ~codes.duplicated()
+    found_codes = codes[selected].tolist()
+    found = set(found_codes)
+    counts = stocks_conversion(watch_remnants.loc[selected, "Количество"]).tolist()
+    stocks = [
+        {
+            "sku": code,
+            "warehouseId": warehouse_id,
+            "items": [{"count": stock, **item_tail}],
+        }
+        for code, stock in zip(found_codes, counts)
+    ]
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append(
-            {
-                "sku": offer_id,
-                "warehouseId": warehouse_id,
-                "items": [
-                    {
-                        "count": 0,
-                        "type": "FIT",
-                        "updatedAt": date,
-                    }
-                ],
-            }
-        )
+    stocks.extend(
+        {
+            "sku": offer_id,
+            "warehouseId": warehouse_id,
+            "items": [{"count": 0, **item_tail}],
+        }
+        for offer_id in dict.fromkeys(offer_ids)
+        if offer_id not in found
+    )
     return stocks
 
 
@@ -189,61 +257,92 @@ def create_prices(watch_remnants, offer_ids):
     """Скорректируем цену на продукцию, которая берется с сайта часов.
 
     Args:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы, остатки и цены
-            с сайта часов
-        offer_ids(list): Список с артикулами товара продавца с ЯндексМаркет
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками
+            и ценами с сайта часов
+        offer_ids(tuple): Артикулы товара продавца с ЯндексМаркет в порядке
+            маркетплейса, функция их не изменяет
 
     Returns:
         prices(list): Сформированный список, в котором цена преображается в нужный формат
             для обновления на маркетплейс ЯндексМаркет
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
+    watches = watch_remnants.loc[watch_remnants["Код"].isin(offer_ids)]
+    # Товары без цены на сайте часов пропускаем, чтобы не сломать всю загрузку
+    no_price = watches["price_int"].isna()
+    if no_price.any():
+        logger.warning(
+            "Пропущены товары без цены: %s", ", ".join(watches.loc[no_price, "Код"])
+        )
+        watches = watches.loc[~no_price]
+    values = watches["price_int"].astype(int).tolist()
+    prices = [
+        {
+            "id": code,
+            # "feed": {"id": 0},
+            "price": {
+                "value": value,
+                # "discountBase": 0,
+                "currencyId": "RUR",
+                # "vat": 0,
+            },
+            # "marketSku": 0,
+            # "shopSku": "string",
+        }
+        for code, value in zip(watches["Код"], values)
+    ]
     return prices
 
 
-async def upload_prices(watch_remnants, campaign_id, market_token):
+async def upload_prices(
+    watch_remnants, campaign_id, market_token, offer_ids=None, client=None
+):
     """Загружаем на маркетплейс ЯндексМаркет обновленный ценник на товары продавца.
 
     Args:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы, остатки и цены
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками и ценами
         campaign_id(str): Идентификатор магазина продавца
         market_token(str): API токен продавца
+        offer_ids(tuple): Артикулы товара продавца, если не указаны,
+            то запрашиваются у маркетплейса
+        client(httpx.AsyncClient): Общий HTTP-клиент, если не указан,
+            то создается на время загрузки
 
     Returns:
         prices(list): Список со статусами подтверждения обновления
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
+    if offer_ids is None:
+        offer_ids = get_offer_ids(campaign_id, market_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    async with use_async_client(client) as client:
+        await gather_batches(
+            update_price_async, divide(prices, 500), campaign_id, market_token, client
+        )
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(
+    watch_remnants,
+    campaign_id,
+    market_token,
+    warehouse_id,
+    offer_ids=None,
+    client=None,
+):
     """Загружаем на маркетплейс ЯндексМаркет информацию о количестве товара в наличии у продавца.
 
     Args:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы, остатки и цены
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками и ценами
         campaign_id(str): Идентификатор магазина продавца
         market_token(str): API токен продавца
+        warehouse_id(int): Идентификатор хранения товара на складе маркетплейса
+            или на складе поставщика
+        offer_ids(tuple): Артикулы товара продавца, если не указаны,
+            то запрашиваются у маркетплейса
+        client(httpx.AsyncClient): Общий HTTP-клиент, если не указан,
+            то создается на время загрузки
 
     Returns:
         not_empty(list): Список в котором указана информация о товаре,
@@ -251,19 +350,20 @@ async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id)
         stocks(list): Список с остатками продукции
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
+    if offer_ids is None:
+        offer_ids = get_offer_ids(campaign_id, market_token)
     stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(
-        filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
-    )
+    async with use_async_client(client) as client:
+        await gather_batches(
+            update_stocks_async, divide(stocks, 2000), campaign_id, market_token, client
+        )
+    not_empty = [stock for stock in stocks if stock["items"][0]["count"] != 0]
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     market_token = env.str("MARKET_TOKEN")
     campaign_fbs_id = env.str("FBS_ID")
@@ -273,30 +373,54 @@ def main():
 
     watch_remnants = download_stock()
     try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
-    except requests.exceptions.ReadTimeout:
+        # Один клиент на все загрузки, чтобы не открывать соединения заново
+        async with create_async_client() as client:
+            # FBS
+            offer_ids = get_offer_ids(campaign_fbs_id, market_token)
+            # Обновить остатки FBS
+            await upload_stocks(
+                watch_remnants,
+                campaign_fbs_id,
+                market_token,
+                warehouse_fbs_id,
+                offer_ids=offer_ids,
+                client=client,
+            )
+            # Поменять цены FBS
+            await upload_prices(
+                watch_remnants,
+                campaign_fbs_id,
+                market_token,
+                offer_ids=offer_ids,
+                client=client,
+            )
+
+            # DBS
+            offer_ids = get_offer_ids(campaign_dbs_id, market_token)
+            # Обновить остатки DBS
+            await upload_stocks(
+                watch_remnants,
+                campaign_dbs_id,
+                market_token,
+                warehouse_dbs_id,
+                offer_ids=offer_ids,
+                client=client,
+            )
+            # Поменять цены DBS
+            await upload_prices(
+                watch_remnants,
+                campaign_dbs_id,
+                market_token,
+                offer_ids=offer_ids,
+                client=client,
+            )
+    except httpx.TimeoutException:
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except httpx.TransportError as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
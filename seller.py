@@ -1,29 +1,200 @@
+import asyncio
+import contextlib
+import datetime
+import email.utils
+import functools
 import io
 import logging.config
+import math
 import os
-import re
+import pickle
+import tempfile
+import time
 import zipfile
+from pathlib import Path
 from environs import Env
 
+import httpx
+import numpy as np
+import orjson
 import pandas as pd
-import requests
 
 logger = logging.getLogger(__file__)
 
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+HTTP_TIMEOUT = httpx.Timeout(30.0)
 
-def get_product_list(last_id, client_id, seller_token):
+
+def create_client():
+    """Создать HTTP/2 клиент с пулом соединений для синхронных запросов.
+
+    Returns:
+        httpx.Client: Клиент, который мультиплексирует запросы в одном TLS соединении
+    """
+    transport = httpx.HTTPTransport(http2=True, limits=HTTP_LIMITS, retries=3)
+    return httpx.Client(transport=transport, timeout=HTTP_TIMEOUT)
+
+
+def create_async_client():
+    """Создать HTTP/2 клиент с пулом соединений для асинхронных запросов.
+
+    Returns:
+        httpx.AsyncClient: Клиент, который мультиплексирует запросы в одном TLS соединении
+    """
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=HTTP_LIMITS, retries=3)
+    return httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT)
+
+
+@contextlib.asynccontextmanager
+async def use_async_client(client=None):
+    """Отдать переданный асинхронный клиент или создать временный.
+
+    Args:
+        client(httpx.AsyncClient): Общий клиент, если он уже есть у вызывающего кода
+
+    Yields:
+        httpx.AsyncClient: Переданный клиент, его закрывает владелец, или новый
+            клиент, который закрывается при выходе из блока
+    """
+    if client is not None:
+        yield client
+        return
+    async with create_async_client() as client:
+        yield client
+
+
+_CLIENT = create_client()
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_ATTEMPTS = 6
+RETRY_BACKOFF = 0.5
+RETRY_MAX_DELAY = 60.0
+
+
+def retry_delay(response, attempt):
+    """Посчитать паузу перед повтором запроса.
+
+    Args:
+        response(httpx.Response): Ответ сервера, после которого повторяем запрос
+        attempt(int): Номер попытки, начиная с нуля
+
+    Returns:
+        float: Пауза в секундах из заголовка Retry-After, а если его нет или
+            он не разбирается, то экспоненциально растущая пауза. Пауза
+            не превышает RETRY_MAX_DELAY
+    """
+    delay = RETRY_BACKOFF * 2**attempt
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is not None:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                if retry_at.tzinfo is None:
+                    retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+                now = datetime.datetime.now(datetime.timezone.utc)
+                delay = (retry_at - now).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    # Retry-After: nan разбирается как float, но паузой быть не может
+    if math.isnan(delay):
+        delay = RETRY_BACKOFF * 2**attempt
+    return min(max(delay, 0.0), RETRY_MAX_DELAY)
+
+
+def send_with_retry(client, method, url, **kwargs):
+    """Отправить запрос и повторить его при ответах 429 и 5xx.
+
+    Args:
+        client(httpx.Client): HTTP-клиент, через который уходит запрос
+        method(str): HTTP-метод
+        url(str): Адрес запроса
+        **kwargs: Остальные аргументы для httpx.Client.request
+
+    Returns:
+        httpx.Response: Первый ответ, который не нужно повторять, или ответ
+            последней попытки
+    """
+    for attempt in range(RETRY_ATTEMPTS):
+        response = client.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUSES:
+            break
+        if attempt < RETRY_ATTEMPTS - 1:
+            time.sleep(retry_delay(response, attempt))
+    return response
+
+
+async def send_with_retry_async(client, method, url, **kwargs):
+    """Асинхронно отправить запрос и повторить его при ответах 429 и 5xx.
+
+    Args:
+        client(httpx.AsyncClient): HTTP-клиент, через который уходит запрос
+        method(str): HTTP-метод
+        url(str): Адрес запроса
+        **kwargs: Остальные аргументы для httpx.AsyncClient.request
+
+    Returns:
+        httpx.Response: Первый ответ, который не нужно повторять, или ответ
+            последней попытки
+    """
+    for attempt in range(RETRY_ATTEMPTS):
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUSES:
+            break
+        if attempt < RETRY_ATTEMPTS - 1:
+            await asyncio.sleep(retry_delay(response, attempt))
+    return response
+
+
+# Здесь хранятся разобранные остатки и ETag/Last-Modified архива с ними
+STOCK_CACHE_DIR = Path.home() / ".cache" / "seller-apis"
+# Меняется вместе с форматом ostatki.pkl, старый кэш тогда не используется
+STOCK_CACHE_VERSION = 2
+
+
+@functools.lru_cache(maxsize=4)
+def _ozon_headers(client_id, seller_token):
+    """Заголовки запросов к Озон, один словарь на каждую пару ключей.
+
+    Тело запросов сериализуется через orjson, поэтому тип содержимого задаем сами.
+    """
+    return {
+        "Content-Type": "application/json",
+        "Client-Id": client_id,
+        "Api-Key": seller_token,
+    }
+
+
+class _DigitsTable(dict):
+    """Таблица для str.translate, которая оставляет в строке только цифры 0-9.
+
+    Любой другой символ, в том числе кириллица, запоминается при первой встрече
+    и дальше удаляется без вызова Python-кода.
+    """
+
+    def __missing__(self, code):
+        self[code] = None
+
+
+_KEEP_DIGITS = _DigitsTable({code: code for code in range(ord("0"), ord("9") + 1)})
+
+
+def get_product_list(last_id, client_id, seller_token, client=None):
     """Отправить запрос на сайт озон и получить список товаров магазина.
 
     Args:
         last_id(str): Идентификатор последнего значения на странице
         client_id(str): Идентификатор клиента
         seller_token(str): API-ключ
+        client(httpx.Client): HTTP-клиент, по умолчанию общий клиент модуля
 
     Returns:
         dict: Словарь с информацией о товарах
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
 
     Example:
         >>> env = Env()
@@ -31,10 +202,7 @@ def get_product_list(last_id, client_id, seller_token):
         >>> {...}
     """
     url = "https://api-seller.ozon.ru/v2/product/list"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    headers = _ozon_headers(client_id, seller_token)
     payload = {
         "filter": {
             "visibility": "ALL",
@@ -42,12 +210,17 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    if client is None:
+        client = _CLIENT
+    response = send_with_retry(
+        client, "POST", url, content=orjson.dumps(payload), headers=headers
+    )
     response.raise_for_status()
     response_object = response.json()
     return response_object.get("result")
 
 
+@functools.lru_cache(maxsize=8)
 def get_offer_ids(client_id, seller_token):
     """Из словаря получить артикулы товаров магазина озон.
 
@@ -56,38 +229,40 @@ def get_offer_ids(client_id, seller_token):
         seller_token(str): API-ключ
 
     Returns:
-        offer_ids(list): Список с артикулами товара продавца
+        offer_ids(tuple): Артикулы товара продавца, результат кэшируется
+            на время работы программы
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
 
     Example:
         >>> env = Env()
         >>> get_offer_ids(, env.str("CLIENT_ID"), env.str("SELLER_TOKEN"))
-        >>> ["143210608", "91132", "136748"...,"137208233"]
+        >>> ("143210608", "91132", "136748"...,"137208233")
     """
+    # Страницы связаны через last_id, поэтому запрашиваются последовательно
+    # через общий клиент
     last_id = ""
-    product_list = []
+    offer_ids = []
     while True:
         some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
+        items = some_prod.get("items")
+        offer_ids.extend(product.get("offer_id") for product in items)
         total = some_prod.get("total")
         last_id = some_prod.get("last_id")
-        if total == len(product_list):
+        if not items or total == len(offer_ids):
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer_id"))
-    return offer_ids
+    return tuple(offer_ids)
 
 
-def update_price(prices: list, client_id, seller_token):
+def update_price(prices: list, client_id, seller_token, client=None):
     """Позволяет изменить цену одного или нескольких товаров продавца на сайте Озон.
 
     Args:
         prices(list): Список с новыми ценами продукции продавца
         client_id(str): Идентификатор клиента
         seller_token(str): API-ключ
+        client(httpx.Client): HTTP-клиент, по умолчанию общий клиент модуля
 
     Returns:
         dict: Словарь в котором указаны данные, например,
@@ -95,26 +270,28 @@ def update_price(prices: list, client_id, seller_token):
             возможные ошибки
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
     url = "https://api-seller.ozon.ru/v1/product/import/prices"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    headers = _ozon_headers(client_id, seller_token)
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
+    if client is None:
+        client = _CLIENT
+    response = send_with_retry(
+        client, "POST", url, content=orjson.dumps(payload), headers=headers
+    )
     response.raise_for_status()
     return response.json()
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+def update_stocks(stocks: list, client_id, seller_token, client=None):
     """Позволяет изменить количество товара в наличии на сайте Озон.
 
     Args:
         stocks(list): Список с остатками продукции
         client_id(str): Идентификатор клиента
         seller_token(str): API-ключ
+        client(httpx.Client): HTTP-клиент, по умолчанию общий клиент модуля
 
     Returns:
         dict: Словарь в котором указаны данные, например,
@@ -122,44 +299,168 @@ def update_stocks(stocks: list, client_id, seller_token):
             возможные ошибки
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
     url = "https://api-seller.ozon.ru/v1/product/import/stocks"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    headers = _ozon_headers(client_id, seller_token)
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
+    if client is None:
+        client = _CLIENT
+    response = send_with_retry(
+        client, "POST", url, content=orjson.dumps(payload), headers=headers
+    )
     response.raise_for_status()
     return response.json()
 
 
+async def update_price_async(prices: list, client_id, seller_token, client):
+    """Асинхронно изменить цену одного или нескольких товаров продавца на сайте Озон.
+
+    Args:
+        prices(list): Список с новыми ценами продукции продавца
+        client_id(str): Идентификатор клиента
+        seller_token(str): API-ключ
+        client(httpx.AsyncClient): HTTP-клиент, через который уходит запрос
+
+    Returns:
+        dict: Словарь в котором указаны данные, например,
+            как идентификатор товара, артикул товара, подтверждение об обновлении и
+            возможные ошибки
+
+    Raises:
+        httpx.HTTPStatusError: Ошибка отклика с сервера
+    """
+    url = "https://api-seller.ozon.ru/v1/product/import/prices"
+    headers = _ozon_headers(client_id, seller_token)
+    payload = {"prices": prices}
+    response = await send_with_retry_async(
+        client, "POST", url, content=orjson.dumps(payload), headers=headers
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def update_stocks_async(stocks: list, client_id, seller_token, client):
+    """Асинхронно изменить количество товара в наличии на сайте Озон.
+
+    Args:
+        stocks(list): Список с остатками продукции
+        client_id(str): Идентификатор клиента
+        seller_token(str): API-ключ
+        client(httpx.AsyncClient): HTTP-клиент, через который уходит запрос
+
+    Returns:
+        dict: Словарь в котором указаны данные, например,
+            как идентификатор товара, артикул товара, подтверждение об обновлении и
+            возможные ошибки
+
+    Raises:
+        httpx.HTTPStatusError: Ошибка отклика с сервера
+    """
+    url = "https://api-seller.ozon.ru/v1/product/import/stocks"
+    headers = _ozon_headers(client_id, seller_token)
+    payload = {"stocks": stocks}
+    response = await send_with_retry_async(
+        client, "POST", url, content=orjson.dumps(payload), headers=headers
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def _write_atomic(path, data: bytes):
+    """Записать файл целиком: сначала во временный файл, затем переименовать.
+
+    Args:
+        path(Path): Куда записать файл
+        data(bytes): Содержимое файла
+    """
+    # У каждого процесса свой временный файл, поэтому одновременные запуски
+    # не перезаписывают друг другу недописанные данные
+    file_descriptor, temp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=path.name + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temp_name, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_name)
+        raise
+
+
 def download_stock():
     """Отправить запрос на сайт часов и сформировать актуальный список по остаткам товара.
 
+    Разобранные остатки кэшируются в STOCK_CACHE_DIR. Если архив на сайте
+    не менялся (ответ 304), повторно он не скачивается и не разбирается.
+
     Returns:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы, остатки и цены
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками и ценами,
+            в столбце price_int цена уже приведена к целому числу
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
     # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
+    cache_file = STOCK_CACHE_DIR / "ostatki.pkl"
+    validators_file = STOCK_CACHE_DIR / "ostatki.etag"
+    headers = {}
+    if cache_file.exists() and validators_file.exists():
+        try:
+            validators = orjson.loads(validators_file.read_bytes())
+        except orjson.JSONDecodeError:
+            validators = {}
+        if not isinstance(validators, dict):
+            validators = {}
+        if validators.get("version") != STOCK_CACHE_VERSION:
+            validators = {}
+        if validators.get("ETag"):
+            headers["If-None-Match"] = validators["ETag"]
+        if validators.get("Last-Modified"):
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+    response = send_with_retry(_CLIENT, "GET", casio_url, headers=headers)
+    if response.status_code == 304:
+        try:
+            with cache_file.open("rb") as file:
+                return pickle.load(file)
+        except Exception as error:
+            # Кэш поврежден, поэтому скачиваем архив заново без условий
+            logger.warning("Не удалось прочитать кэш остатков: %s", error)
+            response = send_with_retry(_CLIENT, "GET", casio_url)
     response.raise_for_status()
-    with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+    # Создаем список остатков часов, читая файл прямо из архива в памяти:
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        with archive.open("ostatki.xls") as excel_file:
+            watch_remnants = pd.read_excel(
+                io=excel_file,
+                engine="xlrd",
+                usecols=["Код", "Количество", "Цена"],
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+            )
+    # Приводим столбцы к нужному виду один раз для всех маркетплейсов
+    watch_remnants["Код"] = watch_remnants["Код"].astype(str)
+    watch_remnants["Количество"] = watch_remnants["Количество"].astype(str)
+    watch_remnants["price_int"] = pd.to_numeric(
+        prices_conversion(watch_remnants["Цена"]), errors="coerce"
+    ).astype("Int64")
+    # Сохраним остатки вместе с ETag/Last-Modified для следующего запуска
+    validators = {
+        "version": STOCK_CACHE_VERSION,
+        "ETag": response.headers.get("ETag"),
+        "Last-Modified": response.headers.get("Last-Modified"),
+    }
+    # Файл с ETag пишется последним, чтобы он не указывал на недописанный кэш,
+    # а ошибка записи кэша не должна мешать обновлению остатков и цен
+    try:
+        STOCK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _write_atomic(cache_file, pickle.dumps(watch_remnants))
+        _write_atomic(validators_file, orjson.dumps(validators))
+    except OSError as error:
+        logger.warning("Не удалось сохранить кэш остатков: %s", error)
     return watch_remnants
 
 
@@ -167,30 +468,31 @@ def create_stocks(watch_remnants, offer_ids):
     """Скорректируем остатки продукции учитывая реальное наличие у продавца.
 
     Args:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы, остатки и цены
-            с сайта часов
-        offer_ids(lict): Список с артикулами товара маркетплейса Озон
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками
+            и ценами с сайта часов
+        offer_ids(tuple): Артикулы товара маркетплейса Озон в порядке
+            маркетплейса, функция их не изменяет
 
     Returns:
         stocks(list): Сформированный список, в котором учитываются
             реальные остатки продукции для обновления на маркетплейс Озон
     """
     # Уберем то, что не загружено в seller
-    stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
+    codes = watch_remnants["Код"]
+    # Повторяющийся артикул учитываем только один раз
+    selected = codes.isin(offer_ids) & ~codes.duplicated()
+    found_codes = codes[selected].tolist()
+    found = set(found_codes)
+    counts = stocks_conversion(watch_remnants.loc[selected, "Количество"]).tolist()
+    stocks = [
+        {"offer_id": code, "stock": stock} for code, stock in zip(found_codes, counts)
+    ]
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append({"offer_id": offer_id, "stock": 0})
+    stocks.extend(
+        {"offer_id": offer_id, "stock": 0}
+        for offer_id in dict.fromkeys(offer_ids)
+        if offer_id not in found
+    )
     return stocks
 
 
@@ -198,25 +500,34 @@ def create_prices(watch_remnants, offer_ids):
     """Скорректируем цену на продукцию, которая берется с сайта часов.
 
     Args:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы, остатки и цены
-            с сайта часов
-        offer_ids(lict): Список с артикулами товара маркетплейса Озон
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками
+            и ценами с сайта часов
+        offer_ids(tuple): Артикулы товара маркетплейса Озон в порядке
+            маркетплейса, функция их не изменяет
 
     Returns:
         prices(list): Сформированный список, в котором цена преображается в нужный формат
             для обновления на маркетплейс Озон
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
+    watches = watch_remnants.loc[watch_remnants["Код"].isin(offer_ids)]
+    # Товары без цены на сайте часов пропускаем, чтобы не сломать всю загрузку
+    no_price = watches["price_int"].isna()
+    if no_price.any():
+        logger.warning(
+            "Пропущены товары без цены: %s", ", ".join(watches.loc[no_price, "Код"])
+        )
+        watches = watches.loc[~no_price]
+    values = watches["price_int"].astype(int).tolist()
+    prices = [
+        {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": code,
+            "old_price": "0",
+            "price": str(value),
+        }
+        for code, value in zip(watches["Код"], values)
+    ]
     return prices
 
 
@@ -231,7 +542,43 @@ def price_conversion(price: str) -> str:
         >>> price_conversion("5'990.00 руб.")
         >>> "5990"
     """
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    return price.split(".", 1)[0].translate(_KEEP_DIGITS)
+
+
+def prices_conversion(prices: pd.Series) -> pd.Series:
+    """Преобразует столбец цен так же, как price_conversion, но для всех строк сразу.
+
+    Args:
+        prices(pd.Series): Цены с дробной частью и с припиской руб
+    Returns:
+          pd.Series: Цены в виде строк с целым числом
+    """
+    return (
+        prices.astype(str)
+        .str.split(".", n=1)
+        .str[0]
+        .str.replace(r"[^0-9]", "", regex=True)
+    )
+
+
+def stocks_conversion(quantities: pd.Series) -> np.ndarray:
+    """Переводит остатки с сайта часов в количество для маркетплейса.
+
+    Остаток ">10" превращается в 100, остаток "1" в 0, остальные остаются как есть.
+
+    Args:
+        quantities(pd.Series): Остатки товара с сайта часов
+    Returns:
+          np.ndarray: Массив с количеством товара
+    """
+    counts = quantities.astype(str)
+    is_many = counts.eq(">10")
+    is_last = counts.eq("1")
+    return np.select(
+        [is_many, is_last],
+        [100, 0],
+        default=counts.mask(is_many | is_last, "0").astype(int),
+    )
 
 
 def divide(lst: list, n: int):
@@ -248,13 +595,61 @@ def divide(lst: list, n: int):
         yield lst[i : i + n]
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+async def gather_batches(update, batches, *args, max_concurrency=8):
+    """Отправить пачки данных на маркетплейс одновременно.
+
+    Args:
+        update: Корутина, которая отправляет одну пачку, например, update_price_async
+        batches: Пачки данных, например, результат divide
+        *args: Остальные аргументы для update
+        max_concurrency(int): Максимальное число одновременных запросов
+
+    Returns:
+        list: Список с ответами маркетплейса по каждой пачке
+
+    Raises:
+        httpx.HTTPStatusError: Ошибка отклика с сервера
+    """
+    batches = enumerate(batches)
+    responses = {}
+
+    async def worker():
+        # Следующая пачка берется из генератора, только когда обработчик
+        # освободился, поэтому в памяти не больше max_concurrency пачек
+        for index, batch in batches:
+            try:
+                responses[index] = await update(batch, *args)
+            except Exception as error:
+                responses[index] = error
+
+    await asyncio.gather(*[worker() for _ in range(max_concurrency)])
+    results = [responses[index] for index in sorted(responses)]
+    # Дожидаемся всех пачек и только потом сообщаем о первой ошибке
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+async def upload_prices(
+    watch_remnants,
+    client_id,
+    seller_token,
+    offer_ids=None,
+    client=None,
+    batch_size=1000,
+):
     """Загружаем на маркетплейс Озон обновленный ценник на товары продавца.
 
     Args:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы, остатки и цены
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками и ценами
         client_id(str): Идентификатор клиента
         seller_token(str): API-ключ
+        offer_ids(tuple): Артикулы товара продавца, если не указаны,
+            то запрашиваются у маркетплейса
+        client(httpx.AsyncClient): Общий HTTP-клиент, если не указан,
+            то создается на время загрузки
+        batch_size(int): Количество цен в одном запросе
 
     Returns:
         prices(list): Список из словарей, в котором указаны данные, такие как
@@ -262,22 +657,35 @@ async def upload_prices(watch_remnants, client_id, seller_token):
             возможные ошибки
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
+    if offer_ids is None:
+        offer_ids = get_offer_ids(client_id, seller_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    async with use_async_client(client) as client:
+        await gather_batches(
+            update_price_async,
+            divide(prices, batch_size),
+            client_id,
+            seller_token,
+            client,
+        )
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(
+    watch_remnants, client_id, seller_token, offer_ids=None, client=None
+):
     """Загружаем на маркетплейс Озон информацию о количестве товара в наличии у продавца.
 
     Args:
-        watch_remnants(dict): Словарь, который содержит актуальные артикулы, остатки и цены
+        watch_remnants(pd.DataFrame): Таблица с актуальными артикулами, остатками и ценами
         client_id(str): Идентификатор клиента
         seller_token(str): API-ключ
+        offer_ids(tuple): Артикулы товара продавца, если не указаны,
+            то запрашиваются у маркетплейса
+        client(httpx.AsyncClient): Общий HTTP-клиент, если не указан,
+            то создается на время загрузки
 
     Returns:
         not_empty(list): Список из словарей, в котором указана информация о товаре,
@@ -287,38 +695,52 @@ async def upload_stocks(watch_remnants, client_id, seller_token):
             возможные ошибки
 
     Raises:
-        requests.exceptions.HTTPError: Ошибка отклика с сервера
+        httpx.HTTPStatusError: Ошибка отклика с сервера
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
+    if offer_ids is None:
+        offer_ids = get_offer_ids(client_id, seller_token)
     stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
-    not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
+    async with use_async_client(client) as client:
+        await gather_batches(
+            update_stocks_async, divide(stocks, 100), client_id, seller_token, client
+        )
+    not_empty = [stock for stock in stocks if stock["stock"] != 0]
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
     try:
         offer_ids = get_offer_ids(client_id, seller_token)
         watch_remnants = download_stock()
-        # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
-        # Поменять цены
-        prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
-    except requests.exceptions.ReadTimeout:
+        # Один клиент на все загрузки, чтобы не открывать соединения заново
+        async with create_async_client() as client:
+            # Обновить остатки
+            await upload_stocks(
+                watch_remnants,
+                client_id,
+                seller_token,
+                offer_ids=offer_ids,
+                client=client,
+            )
+            # Поменять цены
+            await upload_prices(
+                watch_remnants,
+                client_id,
+                seller_token,
+                offer_ids=offer_ids,
+                client=client,
+                batch_size=900,
+            )
+    except httpx.TimeoutException:
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except httpx.TransportError as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())